@@ -1,10 +1,14 @@
 '''API for fetching decisions from the database.'''
 
+import hashlib
+import hmac
 import logging
 import os
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from fastapi import FastAPI, Depends, HTTPException
+import orjson
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
 from dotenv import load_dotenv
@@ -13,12 +17,32 @@ import uvicorn
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 security = HTTPBasic()
 
-# In-memory user store for simplicity
-users = {
-    "admin": "password"
+# Maximum number of results returned by a text search
+SEARCH_LIMIT = 200
+
+# Maximum number of decisions in a page, larger result sets are only streamed as NDJSON
+MAX_PAGE_SIZE = 1000
+
+# Full-text search on the indexed tsv column OR substring search on contenu.
+# The statement text never changes, so asyncpg's per-connection statement cache
+# already reuses its parse and plan, the constant only keeps the SQL in one place.
+SEARCH_QUERY = text("""
+    SELECT text_id, titre, chambre, ts_rank(tsv, q) AS relevance
+    FROM court_history, plainto_tsquery('french', :search) q
+    WHERE (tsv @@ q)
+       OR (lower(contenu::text) LIKE lower(:pattern))
+    ORDER BY relevance DESC, text_id
+    LIMIT :limit OFFSET :offset
+""")
+
+# In-memory user store for simplicity, passwords are kept as SHA-256 digests
+USERS = {
+    "admin": hashlib.sha256(b"password").digest()
 }
 
 # Database configuration from environment variables
@@ -28,24 +52,36 @@ DB_HOST = os.getenv("POSTGRES_HOST")
 DB_PORT = os.getenv("POSTGRES_PORT")
 DB_NAME = os.getenv("POSTGRES_DB")
 
-# Create SQLAlchemy engine and session
-engine = create_engine(f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-def get_db():
+# Create SQLAlchemy async engine and session, the pool is sized for concurrent requests.
+# The search relies on asyncpg's per-connection prepared statement cache, so connect
+# to PostgreSQL directly: a transaction-pooling PgBouncer would break that cache.
+engine = create_async_engine(
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    pool_timeout=30
+)
+SessionLocal = async_sessionmaker(
+    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+async def get_db():
     '''Provide a database session.'''
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 def authenticate(credentials: HTTPBasicCredentials = Depends(security)):
     '''Authenticate the user using HTTP Basic Auth.'''
-    # logging.info("Authenticating user: %s", credentials.username)
-    if credentials.username in users and users[credentials.username] == credentials.password:
-        return credentials.username
-    raise HTTPException(status_code=401, detail="Invalid credentials")
+    # logger.info("Authenticating user: %s", credentials.username)
+    stored = USERS.get(credentials.username)
+    # Constant-time comparison of fixed-size digests, whatever the password length
+    if stored is None or not hmac.compare_digest(
+        stored, hashlib.sha256(credentials.password.encode()).digest()
+    ):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return credentials.username
 
 class Decision(BaseModel):
     '''Pydantic model for a decision.'''
@@ -58,29 +94,59 @@ def read_root():
     '''Root endpoint.'''
     return {"Instruction": "put <</decisions>> without the arrows."}
 
-@app.get("/decisions", response_model=list[Decision])
-def get_decisions(
+async def stream_decisions(query, params):
+    '''Stream decisions as NDJSON from a server-side cursor.'''
+    # The request session is closed before the body is sent, so the stream owns its connection
+    async with engine.connect() as connection:
+        result = await connection.stream(query, params, execution_options={"yield_per": 1000})
+        async for rows in result.partitions():
+            yield b"".join(
+                orjson.dumps({"text_id": row[0], "titre": row[1], "chambre": row[2] or ""}) + b"\n"
+                for row in rows
+            )
+
+# Rows are serialized straight to JSON, the model only documents the responses:
+# a JSON array for a page, one decision per line for the default NDJSON stream
+DECISIONS_RESPONSES = {
+    200: {
+        "model": list[Decision],
+        "description": "A page of decisions as a JSON array when `limit` is given, "
+                       "otherwise every decision streamed as NDJSON.",
+        "content": {
+            "application/x-ndjson": {
+                "schema": {"$ref": "#/components/schemas/Decision"}
+            }
+        },
+    }
+}
+
+@app.get("/decisions", response_class=ORJSONResponse, responses=DECISIONS_RESPONSES)
+async def get_decisions(
     chambre: str = None,
     search: str = None,
+    limit: int = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(default=0, ge=0),
     username: str = Depends(authenticate),
-    db: SessionLocal = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    '''Get a list of decisions, optionally filtered by chambre or searched by text.'''
-    logging.info("Authenticated user: %s", username)
-    logging.info("Fetching decisions for chambre: %s, search: %s", chambre, search)
-
+    '''Get a list of decisions, optionally filtered by chambre or searched by text.
+
+    Without a limit the decisions are streamed as NDJSON, with a limit a page
+    of decisions is returned as a JSON array.'''
+    # Skip building the log records entirely when INFO is disabled
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Authenticated user: %s", username)
+        logger.info("Fetching decisions for chambre: %s, search: %s", chambre, search)
+
+    # A NULL limit means no limit for PostgreSQL, every query is ordered by a unique
+    # key last so consecutive pages neither overlap nor skip rows
+    params = {"limit": limit, "offset": offset}
     if search:
-        # Full-text search on titre and chambre OR substring search on contenu
-        query = text("""
-            SELECT text_id, titre, chambre, 
-                   ts_rank(to_tsvector('french', titre || ' ' || chambre), plainto_tsquery(:search)) AS relevance
-            FROM court_history
-            WHERE (to_tsvector('french', titre || ' ' || chambre) @@ plainto_tsquery(:search))
-               OR (contenu::text ILIKE :pattern)
-            ORDER BY relevance DESC
-        """)
-        # Add wildcards around the search term for the ILIKE comparison.
-        result = db.execute(query, {"search": search, "pattern": f"%{search}%"}).fetchall()
+        query = SEARCH_QUERY
+        # Add wildcards around the search term for the trigram-indexed LIKE comparison.
+        params.update({"search": search, "pattern": f"%{search}%"})
+        # Only the most relevant results are returned for a search
+        params["limit"] = limit or SEARCH_LIMIT
 
     elif chambre:
         if chambre.lower() == "empty" or chambre.lower() == "null":
@@ -91,8 +157,9 @@ def get_decisions(
                     chambre \
                     FROM court_history \
                     WHERE chambre IS NULL \
-                    OR TRIM(chambre) = ''")
-            result = db.execute(query).fetchall()
+                    OR TRIM(chambre) = '' \
+                    ORDER BY text_id \
+                    LIMIT :limit OFFSET :offset")
         else:
         # Filter by chambre (case-insensitive, trim whitespace)
             query = text(
@@ -100,27 +167,37 @@ def get_decisions(
                 titre, \
                 chambre \
                 FROM court_history \
-                WHERE TRIM(chambre) ILIKE :chambre")
-            result = db.execute(query, {"chambre": chambre}).fetchall()
+                WHERE TRIM(chambre) ILIKE :chambre \
+                ORDER BY text_id \
+                LIMIT :limit OFFSET :offset")
+            params["chambre"] = chambre
     else:
         # Fetch all decisions
-        query = text("SELECT text_id, titre, chambre FROM court_history")
-        result = db.execute(query).fetchall()
+        query = text("SELECT text_id, titre, chambre FROM court_history \
+            ORDER BY text_id LIMIT :limit OFFSET :offset")
+
+    if limit is None:
+        return StreamingResponse(stream_decisions(query, params), media_type="application/x-ndjson")
 
-    return [Decision(text_id=row[0], titre=row[1], chambre=row[2] or "") for row in result]
+    result = (await db.execute(query, params)).fetchall()
+    return ORJSONResponse(
+        [{"text_id": row[0], "titre": row[1], "chambre": row[2] or ""} for row in result]
+    )
 
 
 @app.get("/decisions/{text_id}")
-def get_decision_content(
+async def get_decision_content(
     text_id: str,
-    db: SessionLocal = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     '''Get the content of a decision by its text_id.'''
-    query = text("SELECT contenu FROM court_history WHERE text_id = :text_id")
-    result = db.execute(query, {"text_id": text_id}).fetchone()
+    query = text("SELECT contenu::text FROM court_history WHERE text_id = :text_id")
+    result = (await db.execute(query, {"text_id": text_id})).fetchone()
     if result is None:
         raise HTTPException(status_code=404, detail="Decision not found")
-    return {"text_id": text_id, "contenu": result[0]}
+    # contenu is already JSON, embed it as is instead of decoding and encoding it again
+    contenu = orjson.Fragment(result[0]) if result[0] is not None else None
+    return ORJSONResponse({"text_id": text_id, "contenu": contenu})
 
 
 if __name__ == '__main__':
@@ -1,27 +1,39 @@
 '''
-This script downloads tar.gz files from a website, extracts XML files, processes them, 
+This script downloads tar.gz files from a website, streams the XML files out of them, processes them, 
 and stores relevant data in a PostgreSQL database.
 
 Libraries used:
 - requests: to download files
-- tarfile: to extract files
-- xmltodict: to parse XML files
+- tarfile: to read the XML files from the archives
+- lxml: to parse XML files
+- orjson: to serialize the decision content
 - sqlalchemy: to interact with the database
+- psycopg2: to bulk load batches with COPY or execute_values (through the SQLAlchemy raw connection)
 - BeautifulSoup: to scrape links to tar.gz files
 - logging: for detailed logging of the process
 '''
 
 import os
+import io
 import logging
 import tarfile
-import json
 import time
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import orjson
+import psycopg2
+import psycopg2.errors
 import requests
-import xmltodict
+import urllib3
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 from bs4 import BeautifulSoup
+from psycopg2.extras import execute_values
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+from lxml import etree
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -34,13 +46,26 @@ DB_NAME = os.getenv("POSTGRES_DB")
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 PROCESSED_LINKS_FILE = "processed_links.txt"
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # Size of the blocks written while downloading
 BATCH_SIZE = 10000  # Number of records to insert in one batch
+# Share of the listed tarballs left to load above which the search indexes are
+# dropped during the load and rebuilt afterwards
+INDEX_REBUILD_RATIO = 0.2
+MAX_XML_BYTES = 20 << 20  # Larger XML files are skipped, decisions are far smaller
+PARSE_CHUNK_SIZE = 64  # Number of XML files sent to a worker process at once
+MAX_PENDING_CHUNKS = 4 * (os.cpu_count() or 1)  # Chunks read ahead of the workers
+# XML sections holding the record fields
+RECORD_SECTIONS = ('META_COMMUN', 'META_JURI', 'META_JURI_JUDI', 'BLOC_TEXTUEL')
+
+# Reuse connections (and TLS sessions) across all the tarball downloads
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
 
 
 def get_tar_gz_links(url):
     '''Extracts links to tar.gz files from the given URL.'''
     try:
-        response = requests.get(url, timeout=10)
+        response = SESSION.get(url, timeout=10)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, 'html.parser')
         links = [url + link.get('href') for link in soup.find_all('a') if link.get('href', '') \
@@ -57,14 +82,13 @@ def get_tar_gz_links(url):
 def download_file(url, dest_folder):
     '''Downloads a file from the given URL to the destination folder.'''
     try:
-        if not os.path.exists(dest_folder):
-            os.makedirs(dest_folder)
         local_filename = os.path.join(dest_folder, os.path.basename(url))
-        with requests.get(url, stream=True, timeout=30) as r:
+        with SESSION.get(url, stream=True, timeout=30) as r:
             r.raise_for_status()
+            r.raw.decode_content = True
             with open(local_filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
+                # Copy in 1 MiB blocks straight from the socket, without a Python loop per chunk
+                shutil.copyfileobj(r.raw, f, length=DOWNLOAD_CHUNK_SIZE)
         # logging.info("Downloaded file: %s", local_filename)
         return local_filename
     except requests.Timeout:
@@ -76,122 +100,298 @@ def download_file(url, dest_folder):
     except requests.RequestException as e:
         logging.error("Error downloading file %s: %s", url.split('/')[-1], e)
         return None
+    except urllib3.exceptions.HTTPError as e:
+        # Errors while reading the raw stream are not wrapped by requests
+        logging.error("Error while streaming file %s: %s", url.split('/')[-1], e)
+        return None
     except OSError as e:
         logging.error("OS error while saving file %s: %s", url.split('/')[-1], e)
         return None
 
 
-def extract_tar_gz(tar_gz_path, extract_folder):
-    '''Extracts the contents of a tar.gz file to the extract folder.'''
+def clean_contenu(contenu):
+    """Clean up the parsed 'contenu' field by removing null values 
+    from 'br', then serialize it to a JSON string in a single pass."""
+    if isinstance(contenu, dict):
+        # Remove 'null' values from "br" list if it exists
+        contenu.pop("br", None)
+    elif isinstance(contenu, str):
+        # Text-only content, just clean spaces and line breaks
+        contenu = contenu.strip()
+    return orjson.dumps(contenu).decode()
+
+
+def element_to_dict(elem):
+    '''Converts an element to the structure xmltodict builds for it, so the stored
+    contenu keeps its format: attributes as '@name', children by tag (repeated
+    children as a list) and the stripped text as '#text', or just the text
+    for an element without attributes and children.'''
+    item = {'@' + key: value for key, value in elem.attrib.items()}
+    text_parts = [elem.text] if elem.text else []
+    for child in elem:
+        if isinstance(child.tag, str):  # Skip comments and processing instructions
+            value = element_to_dict(child)
+            if child.tag not in item:
+                item[child.tag] = value
+            elif isinstance(item[child.tag], list):
+                item[child.tag].append(value)
+            else:
+                item[child.tag] = [item[child.tag], value]
+        if child.tail:
+            text_parts.append(child.tail)
+    text_content = ''.join(text_parts).strip() or None
+    if not item:
+        return text_content
+    if text_content:
+        item['#text'] = text_content
+    return item
+
+
+def parse_bytes(xml_content, name):
+    '''Parses the content of a single XML file and returns its record,
+    or None if it cannot be used.'''
+    try:
+        # lxml still builds the whole tree, but only the sections holding the
+        # record fields are converted to dicts, each one is freed once converted
+        sections = {}
+        for _, elem in etree.iterparse(io.BytesIO(xml_content), events=('end',),
+                                       tag=RECORD_SECTIONS, resolve_entities=False):
+            sections.setdefault(elem.tag, element_to_dict(elem))
+            # Free the section and the siblings already read to keep memory flat
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        # Extract and validate data
+        return extract_record(sections)
+
+    except etree.XMLSyntaxError as e:
+        logging.error("Error parsing XML file %s: %s", name, e)
+    except ValueError as e:
+        logging.error("value error processing file %s: %s", name, e)
+    return None
+
+
+def parse_chunk(chunk):
+    '''Parses a chunk of (name, content) XML files, runs in a worker process.'''
+    records = []
+    for name, xml_content in chunk:
+        try:
+            records.append(parse_bytes(xml_content, name))
+        except Exception as e:  # One malformed file must not fail the whole tarball
+            logging.error("Unexpected error processing file %s: %s", name, e)
+            records.append(None)
+    return records
+
+
+def iter_xml_chunks(tar):
+    '''Reads the XML files of a streamed tar archive in chunks of (name, content) pairs.'''
+    chunk = []
+    for member in tar:
+        if not (member.isfile() and member.name.endswith('.xml')):
+            continue
+        # Skip oversized files before reading them rather than after parsing them
+        if member.size > MAX_XML_BYTES:
+            logging.warning("Skipping oversized file: %s (%d bytes)", member.name, member.size)
+            continue
+        chunk.append((member.name, tar.extractfile(member).read()))
+        if len(chunk) >= PARSE_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_tar(tar, executor):
+    '''Yields the records of the XML files in a streamed tar archive, 
+    parsed by the executor in archive order.'''
+    pending = deque()
+    for chunk in iter_xml_chunks(tar):
+        pending.append(executor.submit(parse_chunk, chunk))
+        # Bound the number of files held in memory while the workers catch up
+        if len(pending) >= MAX_PENDING_CHUNKS:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def process_tar_gz(tar_gz_path, engine, executor):
+    '''Streams the XML files out of a tar.gz file without extracting it to disk,
+    parses them with the executor and saves the data to the database in batches.
+    Returns True only if the whole archive was read and every batch was committed.'''
+    batch_records = []  # List to accumulate records for batch insertion
+    loaded = True
+
     try:
-        if not os.path.exists(extract_folder):
-            os.makedirs(extract_folder)
-        with tarfile.open(tar_gz_path, 'r:gz') as tar:
-            tar.extractall(path=extract_folder)
-        # logging.info("Extracted %s to %s", tar_gz_path, extract_folder)
+        with tarfile.open(tar_gz_path, 'r|gz') as tar:
+            for record in parse_tar(tar, executor):
+                if record:
+                    batch_records.append(record)
+                # Insert batch if size limit is reached
+                if len(batch_records) >= BATCH_SIZE:
+                    loaded &= insert_batch_to_db(batch_records, engine)
+                    batch_records = []  # Clear the batch after insertion
     except FileNotFoundError as e:
         logging.error("File not found: %s. Error: %s", tar_gz_path, e)
+        loaded = False
     except tarfile.TarError as e:
         logging.error("Error processing tar.gz file %s: %s", tar_gz_path, e)
-    except PermissionError as e:
-        logging.error("Permission error while accessing %s: %s", extract_folder, e)
+        loaded = False
     except OSError as e:
-        logging.error("OS error while extracting %s: %s", tar_gz_path, e)
-
-
-def clean_contenu(contenu):
-    """Clean up the 'contenu' field by removing null values 
-    from 'br' and cleaning excessive spaces and line breaks."""
-    try:
-        # Parse JSON content
-        data = json.loads(contenu)
-        # Remove 'null' values from "br" list if it exists
-        if isinstance(data, dict) and "br" in data:
-            del data["br"]
-        # Convert back to a JSON string
-        cleaned_json = json.dumps(data, ensure_ascii=False)
-        return cleaned_json.strip()
-    except json.JSONDecodeError:
-        # If input is not valid JSON, just clean spaces and line breaks
-        return contenu.strip()
-
-
-def process_xml_files(directory, engine):
-    '''Processes the XML files in the given directory 
-    and saves the data to the database in batches.'''
-    batch_records = []  # List to accumulate records for batch insertion
-
-    for root, _, files in os.walk(directory):
-        xml_files = [file for file in files if file.endswith('.xml')]
-        for file in xml_files:
-            file_path = os.path.join(root, file)
-            start_time = time.time()  # Track processing time
-            try:
-                with open(file_path, 'r', encoding='utf-8') as xml_file:
-                    xml_content = xml_file.read()
-                    parsed_xml = xmltodict.parse(xml_content)
-                    if time.time() - start_time > 30:  # Stop if processing takes too long
-                        logging.error("Skipping file due to timeout: %s", file_path)
-                        continue
-                    # Extract and validate data
-                    record = extract_record(parsed_xml)
-                    if record:
-                        batch_records.append(record)
-                    # Insert batch if size limit is reached
-                    if len(batch_records) >= BATCH_SIZE:
-                        insert_batch_to_db(batch_records, engine)
-                        batch_records = []  # Clear the batch after insertion
-
-            except FileNotFoundError as e:
-                logging.error("File not found: %s. Error: %s", file_path, e)
-            except xmltodict.expat.ExpatError as e:
-                logging.error("Error parsing XML file %s: %s", file_path, e)
-            except ValueError as e:
-                logging.error("value error processing file %s: %s", file_path, e)
+        logging.error("OS error while reading %s: %s", tar_gz_path, e)
+        loaded = False
 
     # Insert any remaining records in the batch
     if batch_records:
-        insert_batch_to_db(batch_records, engine)
+        loaded &= insert_batch_to_db(batch_records, engine)
+    return loaded
+
 
+def dig(data, *keys, default=None):
+    '''Follows keys through nested dicts without building intermediate empty dicts,
+    returns the default as soon as a level is missing or is not a dict.'''
+    for key in keys:
+        data = data.get(key) if isinstance(data, dict) else None
+        if data is None:
+            return default
+    return data
 
-def extract_record(parsed_xml):
-    '''Extracts and validates a single record from the parsed XML.'''
+
+def extract_record(sections):
+    '''Extracts and validates a single record from the parsed XML sections.'''
     try:
-        text_id = parsed_xml.get('TEXTE_JURI_JUDI', {}).get('META', {}) \
-            .get('META_COMMUN', {}).get('ID')
-        titre = parsed_xml.get('TEXTE_JURI_JUDI', {}).get('META', {}) \
-            .get('META_SPEC', {}).get('META_JURI', {}).get('TITRE')
-        chambre = parsed_xml.get('TEXTE_JURI_JUDI', {}).get('META', {}) \
-            .get('META_SPEC', {}).get('META_JURI_JUDI', {}).get('FORMATION')
+        text_id = dig(sections, 'META_COMMUN', 'ID')
+        if not text_id:
+            logging.error("Skipping record without an ID")
+            return None
+        titre = dig(sections, 'META_JURI', 'TITRE')
+        chambre = dig(sections, 'META_JURI_JUDI', 'FORMATION')
         # Validate and clean 'chambre'
         chambre = chambre.strip() if chambre else None
-        contenu = clean_contenu(json.dumps(parsed_xml
-            .get('TEXTE_JURI_JUDI', {}).get('TEXTE', {}).get('BLOC_TEXTUEL', {}).get('CONTENU')))
+        contenu = clean_contenu(dig(sections, 'BLOC_TEXTUEL', 'CONTENU'))
         return {
                 "text_id": text_id,
                 "titre": titre,
                 "chambre": chambre,
                 "contenu": contenu
         }
-    except (KeyError, TypeError, json.JSONDecodeError) as e:
+    except (KeyError, TypeError, AttributeError) as e:
         logging.error("Error extracting record: %s", e)
         return None
 
 
+def batch_rows(batch_records):
+    '''Yields the column values of each record, ready to be sent to PostgreSQL.'''
+    for record in batch_records:
+        # PostgreSQL rejects NUL characters in text, strip them before sending the rows
+        yield tuple(
+            value.replace('\x00', '') if isinstance(value, str) else value
+            for value in (record["text_id"], record["titre"],
+                          record["chambre"], record["contenu"])
+        )
+
+
+def csv_field(value):
+    '''Formats a value for COPY ... (FORMAT csv): NULL is an unquoted empty field,
+    every other value is quoted so an empty string stays an empty string.'''
+    if value is None:
+        return ''
+    return '"' + value.replace('"', '""') + '"'
+
+
+def copy_batch(cursor, batch_records):
+    '''Streams a batch with COPY into a temporary staging table, then merges it
+    into court_history with a single INSERT ... SELECT.'''
+    buffer = io.StringIO()
+    buffer.writelines(
+        ','.join(csv_field(value) for value in row) + '\n'
+        for row in batch_rows(batch_records)
+    )
+    buffer.seek(0)
+
+    cursor.execute("""
+        CREATE TEMP TABLE court_history_stage
+        (LIKE court_history INCLUDING DEFAULTS) ON COMMIT DROP
+    """)
+    cursor.copy_expert("""
+        COPY court_history_stage (text_id, titre, chambre, contenu)
+        FROM STDIN WITH (FORMAT csv)
+    """, buffer)
+    cursor.execute("""
+        INSERT INTO court_history (text_id, titre, chambre, contenu)
+        SELECT text_id, titre, chambre, contenu FROM court_history_stage
+        ON CONFLICT (text_id) DO NOTHING
+    """)
+
+
+def insert_batch_values(cursor, batch_records):
+    '''Inserts a batch with multi-row INSERT statements, 
+    for servers or proxies where COPY is not available.'''
+    execute_values(cursor, """
+        INSERT INTO court_history (text_id, titre, chambre, contenu)
+        VALUES %s
+        ON CONFLICT (text_id) DO NOTHING
+    """, list(batch_rows(batch_records)), page_size=1000)
+
+
 def insert_batch_to_db(batch_records, engine):
-    '''Inserts a batch of records into the database.'''
+    '''Inserts a batch of records into the database, returns whether it was committed.
+
+    The batch is bulk loaded with COPY so duplicates are still skipped by ON CONFLICT
+    without paying a parse/plan round-trip per row, and falls back to multi-row
+    INSERT statements when COPY is refused.'''
+    connection = engine.raw_connection()
     try:
-        with engine.connect() as connection:
-            query = text("""
-                INSERT INTO court_history (text_id, titre, chambre, contenu) 
-                VALUES (:text_id, :titre, :chambre, :contenu)
-                         ON CONFLICT (text_id, titre, chambre) DO NOTHING
-            """)
-            connection.execute(query, batch_records)
-            connection.commit()
-            logging.info("Inserted batch of %d records into the database.", len(batch_records))
+        cursor = connection.cursor()
+        try:
+            copy_batch(cursor, batch_records)
+        except (psycopg2.errors.InsufficientPrivilege, psycopg2.errors.FeatureNotSupported) as e:
+            # Only a refused COPY is retried, data and connection errors would fail again
+            logging.warning("COPY refused, inserting the batch with INSERT ... VALUES: %s", e)
+            connection.rollback()
+            insert_batch_values(cursor, batch_records)
+        connection.commit()
+        logging.info("Inserted batch of %d records into the database.", len(batch_records))
+        return True
     except Exception as e:
         logging.error("****Error inserting batch to database****: %s", e)
+        try:
+            connection.rollback()
+        except psycopg2.Error as rollback_error:
+            # The connection is gone, there is nothing left to roll back
+            logging.error("Could not roll back the batch: %s", rollback_error)
+        return False
+    finally:
+        connection.close()
+
+
+def drop_search_index(engine):
+    '''Drops the search indexes before a large bulk load.'''
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX IF EXISTS court_history_tsv_idx"))
+        connection.execute(text("DROP INDEX IF EXISTS court_history_contenu_trgm"))
+    logging.info("Dropped the search indexes for the bulk load.")
+
+
+def create_search_index(engine):
+    '''Creates the search indexes in one pass over the loaded table.'''
+    with engine.begin() as connection:
+        # Give the single index build enough memory to sort in RAM
+        connection.execute(text("SET LOCAL maintenance_work_mem = '1GB'"))
+        # Create a GIN index for full-text search
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS court_history_tsv_idx
+            ON court_history
+            USING gin(tsv)
+        """))
+        logging.info("Checked/Created the 'court_history_tsv_idx' index.")
+
+        # Create a trigram index for substring search on contenu
+        connection.execute(text("""
+            CREATE INDEX IF NOT EXISTS court_history_contenu_trgm
+            ON court_history
+            USING gin(lower(contenu::text) gin_trgm_ops)
+        """))
+        logging.info("Checked/Created the 'court_history_contenu_trgm' index.")
 
 
 def load_processed_links():
@@ -202,10 +402,50 @@ def load_processed_links():
     return set()
 
 
-def save_processed_link(link):
-    '''Saves a processed link to the file.'''
-    with open(PROCESSED_LINKS_FILE, 'a', encoding='utf-8') as file:
-        file.write(link + '\n')
+def open_processed_links():
+    '''Opens the processed links file once for buffered appends.'''
+    return open(PROCESSED_LINKS_FILE, 'a', buffering=1 << 16, encoding='utf-8')
+
+
+def save_processed_link(processed_file, link):
+    '''Saves a processed link to the file, once its tarball is in the database.'''
+    processed_file.write(link + '\n')
+    processed_file.flush()
+
+
+def process_links(tar_gz_links, processed_links, dest_folder, engine):
+    '''Downloads and loads every tar.gz link that was not processed yet.'''
+    # Files are independent, parse them on every core and insert from this process,
+    # the same workers serve every tarball of the run
+    executor = ProcessPoolExecutor()
+    try:
+        with open_processed_links() as processed_file:
+            for link in tar_gz_links:
+                if link in processed_links:
+                    logging.info("Skipping already processed link: %s", link.split('/')[-1])
+                    continue
+
+                logging.info("====Processing file====: %s", link.split('/')[-1])
+                tar_gz_path = download_file(link, dest_folder)
+                if tar_gz_path:
+                    try:
+                        loaded = process_tar_gz(tar_gz_path, engine, executor)
+                    except BrokenProcessPool as e:
+                        # A worker died (e.g. killed for memory), restart the pool
+                        # and leave the link unprocessed so the next run retries it
+                        logging.error("Parsing workers crashed on %s: %s",
+                                      link.split('/')[-1], e)
+                        executor.shutdown(cancel_futures=True)
+                        executor = ProcessPoolExecutor()
+                        continue
+                    if loaded:
+                        save_processed_link(processed_file, link)
+                    else:
+                        # Keep the link unprocessed so the next run loads it again
+                        logging.error("Not all data of %s was saved, it will be retried",
+                                      link.split('/')[-1])
+    finally:
+        executor.shutdown(cancel_futures=True)
 
 
 def main():
@@ -217,7 +457,6 @@ def main():
         logging.error("Base URL not set in environment variables.")
         return
     dest_folder = "downloads"
-    extract_folder = "extracted_files"
 
     # Load previously processed links
     processed_links = load_processed_links()
@@ -226,38 +465,82 @@ def main():
     tar_gz_links = get_tar_gz_links(base_url)
 
     if tar_gz_links:
+        os.makedirs(dest_folder, exist_ok=True)
         engine = create_engine(DATABASE_URL) # Create a database engine
         with engine.begin() as connection:   # Ensure table exists before inserting data
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
             connection.execute(text("""
                 CREATE TABLE IF NOT EXISTS court_history (
-                    text_id VARCHAR(255),
+                    text_id VARCHAR(255) PRIMARY KEY,
                     titre TEXT,
                     chambre TEXT, 
-                    contenu TEXT,
-                    CONSTRAINT unique_record UNIQUE (text_id, titre, chambre)                 
+                    contenu JSONB
                 )
             """))
             logging.info("Checked/Created the 'court_history' table.")
 
-            # Create a GIN index for full-text search
-            connection.execute(text("""
-                CREATE INDEX IF NOT EXISTS court_history_tsv_idx 
-                ON court_history 
-                USING gin(to_tsvector('french', titre || ' ' || chambre || ' ' || contenu))
-            """))
-            logging.info("Checked/Created the 'court_history_tsv_idx' index.")
-
-        for link in tar_gz_links:
-            if link in processed_links:
-                logging.info("Skipping already processed link: %s", link.split('/')[-1])
-                continue
-
-            logging.info("====Processing file====: %s", link.split('/')[-1])
-            tar_gz_path = download_file(link, dest_folder)
-            if tar_gz_path:
-                extract_tar_gz(tar_gz_path, extract_folder)
-                process_xml_files(extract_folder, engine)
-                save_processed_link(link)
+            # Older tables were only unique on (text_id, titre, chambre), key them on text_id
+            has_primary_key = connection.execute(text("""
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = 'court_history'::regclass AND contype = 'p'
+            """)).first()
+            if not has_primary_key:
+                connection.execute(text("DELETE FROM court_history WHERE text_id IS NULL"))
+                connection.execute(text("""
+                    DELETE FROM court_history a USING court_history b
+                    WHERE a.text_id = b.text_id AND a.ctid > b.ctid
+                """))
+                connection.execute(text("""
+                    ALTER TABLE court_history
+                    DROP CONSTRAINT IF EXISTS unique_record,
+                    ADD PRIMARY KEY (text_id)
+                """))
+                logging.info("Added the 'text_id' primary key.")
+
+            # Older tables stored contenu as JSON text, convert it to jsonb
+            contenu_type = connection.execute(text("""
+                SELECT data_type FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                  AND table_name = 'court_history' AND column_name = 'contenu'
+            """)).scalar()
+            if contenu_type != 'jsonb':
+                # Everything derived from the text column is rebuilt below and after the load
+                connection.execute(text("ALTER TABLE court_history DROP COLUMN IF EXISTS tsv"))
+                connection.execute(text("DROP INDEX IF EXISTS court_history_tsv_idx"))
+                connection.execute(text("DROP INDEX IF EXISTS court_history_contenu_trgm"))
+                connection.execute(text("""
+                    ALTER TABLE court_history
+                    ALTER COLUMN contenu TYPE jsonb USING contenu::jsonb
+                """))
+                logging.info("Converted the 'contenu' column to jsonb.")
+
+            # Keep the search vector in a stored generated column so queries hit the index
+            tsv_exists = connection.execute(text("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = current_schema()
+                  AND table_name = 'court_history' AND column_name = 'tsv'
+            """)).first()
+            if not tsv_exists:
+                # The former expression index is replaced by an index on the column
+                connection.execute(text("DROP INDEX IF EXISTS court_history_tsv_idx"))
+                connection.execute(text("""
+                    ALTER TABLE court_history ADD COLUMN tsv tsvector
+                    GENERATED ALWAYS AS (
+                        to_tsvector('french', coalesce(titre, '') || ' ' || coalesce(chambre, ''))
+                        || to_tsvector('french', coalesce(contenu, '{}'))) STORED
+                """))
+                logging.info("Added the generated 'tsv' column.")
+
+        # Rebuilding the GIN indexes in one pass only pays off when the load is large
+        # compared with the table (e.g. the first run), small daily loads update them
+        pending_links = [link for link in tar_gz_links if link not in processed_links]
+        if len(pending_links) > INDEX_REBUILD_RATIO * len(tar_gz_links):
+            drop_search_index(engine)
+        try:
+            process_links(tar_gz_links, processed_links, dest_folder, engine)
+        finally:
+            # Restore the indexes even if the load stopped halfway, the API needs them
+            create_search_index(engine)
 
         logging.info("====Pipeline completed successfully====.")
         end_time = time.time()